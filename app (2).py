@@ -3,8 +3,10 @@ import fitz  # PyMuPDF
 import re
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import json
 import sqlite3
+import threading
 from pathlib import Path
 
 # Set page config
@@ -35,101 +37,187 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Database setup
-def init_db():
-    conn = sqlite3.connect("projects.db")
+# Extraction patterns. Field patterns run case-sensitively against an
+# upper-cased copy of the text: re.IGNORECASE would disable re's literal-prefix
+# search and make every scan several times slower than the upper() copy costs.
+_ADDR_RE = re.compile(r'(\d+\s+[A-Z]+\s+(?:AVENUE|AVE|STREET|ST|ROAD|RD|DRIVE|DR))')
+
+_BLOCK_RE = re.compile(r'BLOCK\s*(\d+(?:\.\d+)?)')
+_LOT_RE = re.compile(r'LOT\s*(\d+(?:\.\d+)?)')
+_SIDEWALK_RE = re.compile(r'(\d+(?:\.\d+)?)\s*[xX×]\s*(\d+(?:\.\d+)?)\s*(?:SIDEWALK|WALK)')
+
+# The gap between a label and its number is capped and kept on one line, so
+# a label with no number after it can't scan on to the end of the text
+_APRON_RE = re.compile(r'APRON[^\d\n]{0,120}(\d+(?:\.\d+)?)\s*[xX×]\s*(\d+(?:\.\d+)?)')
+_CURB_RE = re.compile(r'(?:CURB|D-CURB)[^\d\n]{0,120}(\d+(?:\.\d+)?)')
+_DRIVEWAY_RE = re.compile(r'DRIVEWAY[^\d\n]{0,120}(\d+(?:\.\d+)?)\s*[xX×]\s*(\d+(?:\.\d+)?)')
+
+# Display header for each projects column, in table order
+COLUMNS = {
+    'id': 'ID',
+    'address': 'Address',
+    'block': 'Block',
+    'lot': 'Lot',
+    'sidewalk_sf': 'Sidewalk SF',
+    'apron_sf': 'Apron SF',
+    'curb_lf': 'Curb LF',
+    'driveway_sf': 'Driveway SF',
+    'sidewalk_cy': 'Sidewalk CY',
+    'apron_cy': 'Apron CY',
+    'curb_cy': 'Curb CY',
+    'driveway_cy': 'Driveway CY',
+    'total_sf': 'Total SF',
+    'total_cy': 'Total CY',
+    'created_at': 'Date',
+    'notes': 'Notes',
+}
+
+def _select_columns(*names):
+    return ", ".join(f'{name} AS "{COLUMNS[name]}"' for name in names)
+
+# Database setup (one connection per server process, shared across reruns)
+SCHEMA_VERSION = 1
+
+@st.cache_resource
+def get_conn():
+    conn = sqlite3.connect("projects.db", check_same_thread=False)
     c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS projects (
-            id INTEGER PRIMARY KEY,
-            address TEXT,
-            block TEXT,
-            lot TEXT,
-            sidewalk_sf REAL,
-            apron_sf REAL,
-            curb_lf REAL,
-            driveway_sf REAL,
-            sidewalk_cy REAL,
-            apron_cy REAL,
-            curb_cy REAL,
-            driveway_cy REAL,
-            total_sf REAL,
-            total_cy REAL,
-            created_at TIMESTAMP,
-            notes TEXT
-        )
-    """)
-    conn.commit()
+    # WAL + synchronous=NORMAL: commits append to the log instead of
+    # rewriting a rollback journal, and only checkpoints fsync
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=5000")
+    c.execute("PRAGMA temp_store=MEMORY")
+
+    # Schema is only (re)applied when the file's user_version is behind;
+    # bump SCHEMA_VERSION and add a migration step when the schema changes
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS projects (
+                id INTEGER PRIMARY KEY,
+                address TEXT,
+                block TEXT,
+                lot TEXT,
+                sidewalk_sf REAL,
+                apron_sf REAL,
+                curb_lf REAL,
+                driveway_sf REAL,
+                sidewalk_cy REAL,
+                apron_cy REAL,
+                curb_cy REAL,
+                driveway_cy REAL,
+                total_sf REAL,
+                total_cy REAL,
+                created_at TIMESTAMP,
+                notes TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_projects_created ON projects(created_at);
+            PRAGMA user_version = {SCHEMA_VERSION};
+        """)
     return conn
 
+@st.cache_resource
+def _db_lock():
+    # The shared connection is used from every session's script thread;
+    # writes (with their version bump) and cached reads hold this lock so
+    # transactions can't interleave
+    return threading.Lock()
+
 # PDF extraction
-class PlotPlanExtractor:
-    def __init__(self):
-        self.measurements = {
-            'address': '',
-            'block': '',
-            'lot': '',
-            'sidewalk_sqft': 0,
-            'apron_sqft': 0,
-            'curb_lf': 0,
-            'driveway_sqft': 0,
-        }
-
-    def extract(self, pdf_bytes):
-        try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            text = ""
+def _page_text(page):
+    # Raw text blocks are all the regexes need: (x0, y0, x1, y1, text, block_no, block_type)
+    text = "\n".join(block[4] for block in page.get_text("blocks") if block[6] == 0)
+    # Fall back to full text extraction for pages that yield no text blocks
+    return text or page.get_text()
+
+# Defaults for fields the PDF doesn't mention; shared, never mutated
+_EMPTY_MEASUREMENTS = {
+    'address': '',
+    'block': '',
+    'lot': '',
+    'sidewalk_sqft': 0,
+    'apron_sqft': 0,
+    'curb_lf': 0,
+    'driveway_sqft': 0,
+}
+
+def extract_plot_plan(pdf_bytes):
+    # Runs on a worker thread with no Streamlit context, so a read error is
+    # returned alongside whatever was found instead of being shown here
+    found = {}
+    error = None
+    try:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            # Parse page by page and stop once every field has a hit
             for page in doc:
-                text += page.get_text()
-            doc.close()
+                if _parse_text(_page_text(page), found) == 0:
+                    break
+    except Exception as e:
+        error = f"Error reading PDF: {e}"
 
-            self._parse_text(text)
-            return self.measurements
-        except Exception as e:
-            st.error(f"Error reading PDF: {e}")
-            return self.measurements
+    return {**_EMPTY_MEASUREMENTS, **found}, error
 
-    def _parse_text(self, text):
-        text_upper = text.upper()
+def _parse_text(text, found):
+    # Adds fields missing from `found`; returns how many are still missing
+    text_upper = text.upper()
+
+    # Extract address
+    if 'address' not in found:
+        match = _ADDR_RE.search(text)
+        if match:
+            found['address'] = match.group(1)
 
-        # Extract address
-        addr_pattern = r'(\d+\s+[A-Z]+\s+(?:AVENUE|AVE|STREET|ST|ROAD|RD|DRIVE|DR))'
-        match = re.search(addr_pattern, text)
+    # Extract block/lot
+    if 'block' not in found:
+        match = _BLOCK_RE.search(text_upper)
         if match:
-            self.measurements['address'] = match.group(1)
-
-        # Extract block/lot
-        block_match = re.search(r'BLOCK\s*(\d+(?:\.\d+)?)', text_upper)
-        if block_match:
-            self.measurements['block'] = block_match.group(1)
-
-        lot_match = re.search(r'LOT\s*(\d+(?:\.\d+)?)', text_upper)
-        if lot_match:
-            self.measurements['lot'] = lot_match.group(1)
-
-        # Sidewalk
-        sidewalk_pattern = r'(\d+(?:\.\d+)?)\s*[xX×]\s*(\d+(?:\.\d+)?)\s*(?:SIDEWALK|WALK)'
-        matches = re.findall(sidewalk_pattern, text_upper)
-        if matches:
-            self.measurements['sidewalk_sqft'] = float(matches[0][0]) * float(matches[0][1])
-
-        # Apron
-        apron_pattern = r'(?:APRON)[^0-9]*(\d+(?:\.\d+)?)\s*[xX×]\s*(\d+(?:\.\d+)?)'
-        matches = re.findall(apron_pattern, text_upper)
-        if matches:
-            self.measurements['apron_sqft'] = float(matches[0][0]) * float(matches[0][1])
-
-        # Curb
-        curb_pattern = r'(?:CURB|D-CURB)[^0-9]*(\d+(?:\.\d+)?)'
-        match = re.search(curb_pattern, text_upper)
+            found['block'] = match.group(1)
+
+    if 'lot' not in found:
+        match = _LOT_RE.search(text_upper)
+        if match:
+            found['lot'] = match.group(1)
+
+    # Sidewalk
+    if 'sidewalk_sqft' not in found:
+        match = _SIDEWALK_RE.search(text_upper)
+        if match:
+            width, length = match.group(1, 2)  # both dimensions in one call
+            found['sidewalk_sqft'] = float(width) * float(length)
+
+    # Apron
+    if 'apron_sqft' not in found:
+        match = _APRON_RE.search(text_upper)
+        if match:
+            width, length = match.group(1, 2)
+            found['apron_sqft'] = float(width) * float(length)
+
+    # Curb
+    if 'curb_lf' not in found:
+        match = _CURB_RE.search(text_upper)
+        if match:
+            found['curb_lf'] = float(match.group(1))
+
+    # Driveway
+    if 'driveway_sqft' not in found:
+        match = _DRIVEWAY_RE.search(text_upper)
         if match:
-            self.measurements['curb_lf'] = float(match.group(1))
+            width, length = match.group(1, 2)
+            found['driveway_sqft'] = float(width) * float(length)
 
-        # Driveway
-        driveway_pattern = r'(?:DRIVEWAY)[^0-9]*(\d+(?:\.\d+)?)\s*[xX×]\s*(\d+(?:\.\d+)?)'
-        matches = re.findall(driveway_pattern, text_upper)
-        if matches:
-            self.measurements['driveway_sqft'] = float(matches[0][0]) * float(matches[0][1])
+    return len(_EMPTY_MEASUREMENTS) - len(found)
+
+@st.cache_resource
+def _extract_pool():
+    # PyMuPDF is not thread-safe and Streamlit runs each session's script on
+    # its own thread, so every fitz call goes through this one worker thread
+    return ThreadPoolExecutor(max_workers=1)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def extract_from_pdf(pdf_bytes):
+    # Keyed on the uploaded bytes, so reruns from other widgets skip the parse
+    return _extract_pool().submit(extract_plot_plan, pdf_bytes).result()
 
 def calculate_volumes(sidewalk, apron, curb, driveway):
     sidewalk_cy = (sidewalk * 0.333) / 27
@@ -149,38 +237,129 @@ def calculate_volumes(sidewalk, apron, curb, driveway):
         'total_cy': round(total_cy, 2),
     }
 
-def save_project(conn, address, block, lot, sidewalk, apron, curb, driveway, volumes):
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO projects 
-        (address, block, lot, sidewalk_sf, apron_sf, curb_lf, driveway_sf,
-         sidewalk_cy, apron_cy, curb_cy, driveway_cy, total_sf, total_cy, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+_INSERT_PROJECT_SQL = """
+    INSERT INTO projects 
+    (address, block, lot, sidewalk_sf, apron_sf, curb_lf, driveway_sf,
+     sidewalk_cy, apron_cy, curb_cy, driveway_cy, total_sf, total_cy, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def project_row(address, block, lot, sidewalk, apron, curb, driveway, volumes):
+    return (
         address, block, lot, sidewalk, apron, curb, driveway,
         volumes['sidewalk_cy'], volumes['apron_cy'], volumes['curb_cy'], 
         volumes['driveway_cy'], volumes['total_sf'], volumes['total_cy'],
         datetime.now()
-    ))
-    conn.commit()
-
-def get_projects(conn):
-    c = conn.cursor()
-    c.execute("SELECT * FROM projects ORDER BY created_at DESC")
-    return c.fetchall()
+    )
+
+def _clear_calculated():
+    # Any manual-entry edit invalidates the last Calculate result
+    st.session_state.pop("calculated_project", None)
+
+# Saved projects are queued in session state and written in a single
+# transaction. Both steps run as button callbacks, before the rerun draws
+# anything, so the pending count in the sidebar is always current.
+def _queue_calculated():
+    # Row (and its created_at) is built at save time, not at Calculate
+    st.session_state["pending_projects"].append(
+        project_row(*st.session_state.pop("calculated_project"))
+    )
+
+def _commit_pending():
+    pending = st.session_state["pending_projects"]
+    save_projects_bulk(get_conn(), pending)
+    st.session_state["saved_count"] = len(pending)
+    pending.clear()
+
+@st.cache_resource
+def _projects_version():
+    # Process-wide so a save in one session invalidates every session's cache
+    return {'value': 0}
+
+def projects_version():
+    return _projects_version()['value']
+
+def save_projects_bulk(conn, rows):
+    # One transaction (and one commit) for the whole batch
+    with _db_lock():
+        with conn:
+            conn.executemany(_INSERT_PROJECT_SQL, rows)
+        _projects_version()['value'] += 1
+
+_PROJECTS_SQL = f"""
+    SELECT {_select_columns(*COLUMNS)}
+    FROM projects
+    ORDER BY created_at DESC
+"""
+
+@st.cache_data
+def load_projects_df(version):
+    # `version` is only a cache key; it changes whenever projects are saved
+    with _db_lock():
+        return pd.read_sql_query(_PROJECTS_SQL, get_conn())
+
+@st.cache_data
+def load_project_stats(version):
+    # Aggregated by SQLite, no rows fetched. Row factory only on this cursor:
+    # read_sql_query already takes names from cursor.description
+    with _db_lock():
+        c = get_conn().cursor()
+        c.row_factory = sqlite3.Row
+        return dict(c.execute("""
+            SELECT COUNT(*) AS project_count,
+                   AVG(total_cy) AS avg_total_cy,
+                   COALESCE(SUM(total_cy), 0) AS sum_total_cy,
+                   AVG(total_sf) AS avg_total_sf
+            FROM projects
+        """).fetchone())
+
+# The bar chart only shows the most recent projects so it stays readable
+# and cheap to render as the table grows
+CHART_LIMIT = 100
+
+_CHART_SQL = f"""
+    SELECT {_select_columns('address', 'total_cy')}
+    FROM projects
+    ORDER BY created_at DESC
+    LIMIT {CHART_LIMIT}
+"""
+
+@st.cache_data
+def load_chart_data(version):
+    with _db_lock():
+        chart_df = pd.read_sql_query(_CHART_SQL, get_conn())
+    return chart_df.set_index(COLUMNS['address'])[COLUMNS['total_cy']]
+
+@st.cache_data
+def projects_csv(version):
+    return load_projects_df(version).to_csv(index=False).encode()
 
 # Main app
 st.title("📐 Plot Plan Concrete Takeoff Reader")
 st.markdown("Extract measurements from plot plans and calculate concrete volumes")
 
 # Initialize database
-conn = init_db()
+conn = get_conn()
+
+pending = st.session_state.setdefault("pending_projects", [])
 
 # Sidebar
 with st.sidebar:
     st.header("Options")
     view = st.radio("View", ["Upload & Extract", "Saved Projects", "Statistics"])
 
+    # Pending saves are shown on every view so they aren't forgotten
+    if pending:
+        st.warning(
+            f"{len(pending)} project(s) not yet written to the database. "
+            "Click Commit Pending Projects before closing this tab or they will be lost."
+        )
+        st.button("Commit Pending Projects", on_click=_commit_pending)
+
+    saved_count = st.session_state.pop("saved_count", None)
+    if saved_count:
+        st.success(f"Saved {saved_count} project(s)!")
+
 # Main content
 if view == "Upload & Extract":
     col1, col2 = st.columns([1, 1])
@@ -193,8 +372,10 @@ if view == "Upload & Extract":
             st.success("PDF uploaded!")
 
             # Extract from PDF
-            extractor = PlotPlanExtractor()
-            measurements = extractor.extract(uploaded_file.getvalue())
+            with st.spinner("Extracting measurements..."):
+                measurements, error = extract_from_pdf(uploaded_file.getvalue())
+            if error:
+                st.error(error)
 
             st.write("### Extracted Values:")
             col1a, col1b = st.columns(2)
@@ -211,18 +392,18 @@ if view == "Upload & Extract":
 
     with col2:
         st.subheader("Manual Entry")
-        address = st.text_input("Address")
-        block = st.text_input("Block")
-        lot = st.text_input("Lot")
+        address = st.text_input("Address", on_change=_clear_calculated)
+        block = st.text_input("Block", on_change=_clear_calculated)
+        lot = st.text_input("Lot", on_change=_clear_calculated)
 
         col2a, col2b = st.columns(2)
         with col2a:
-            sidewalk = st.number_input("Sidewalk (SF)", min_value=0.0, step=1.0)
-            curb = st.number_input("Curb (LF)", min_value=0.0, step=1.0)
+            sidewalk = st.number_input("Sidewalk (SF)", min_value=0.0, step=1.0, on_change=_clear_calculated)
+            curb = st.number_input("Curb (LF)", min_value=0.0, step=1.0, on_change=_clear_calculated)
 
         with col2b:
-            apron = st.number_input("Apron (SF)", min_value=0.0, step=1.0)
-            driveway = st.number_input("Driveway (SF)", min_value=0.0, step=1.0)
+            apron = st.number_input("Apron (SF)", min_value=0.0, step=1.0, on_change=_clear_calculated)
+            driveway = st.number_input("Driveway (SF)", min_value=0.0, step=1.0, on_change=_clear_calculated)
 
         if st.button("Calculate"):
             if address:
@@ -240,30 +421,26 @@ if view == "Upload & Extract":
                     "volumes": volumes
                 })
 
-                if st.button("Save Project"):
-                    save_project(conn, address, block, lot, sidewalk, apron, curb, driveway, volumes)
-                    st.success("Project saved!")
+                st.session_state["calculated_project"] = (
+                    address, block, lot, sidewalk, apron, curb, driveway, volumes
+                )
             else:
                 st.error("Please enter an address")
 
+        if "calculated_project" in st.session_state:
+            st.button("Save Project", on_click=_queue_calculated)
+
 elif view == "Saved Projects":
     st.subheader("All Projects")
-    projects = get_projects(conn)
-
-    if projects:
-        df = pd.DataFrame(projects, columns=[
-            'ID', 'Address', 'Block', 'Lot', 'Sidewalk SF', 'Apron SF', 
-            'Curb LF', 'Driveway SF', 'Sidewalk CY', 'Apron CY', 
-            'Curb CY', 'Driveway CY', 'Total SF', 'Total CY', 'Date', 'Notes'
-        ])
+    df = load_projects_df(projects_version())
 
+    if not df.empty:
         st.dataframe(df, use_container_width=True)
 
         # Export button
-        csv = df.to_csv(index=False)
         st.download_button(
             label="Download as CSV",
-            data=csv,
+            data=projects_csv(projects_version()),
             file_name=f"projects_{datetime.now().strftime('%Y%m%d')}.csv",
             mime="text/csv"
         )
@@ -272,26 +449,22 @@ elif view == "Saved Projects":
 
 elif view == "Statistics":
     st.subheader("Project Statistics")
-    projects = get_projects(conn)
-
-    if projects:
-        df = pd.DataFrame(projects, columns=[
-            'ID', 'Address', 'Block', 'Lot', 'Sidewalk SF', 'Apron SF', 
-            'Curb LF', 'Driveway SF', 'Sidewalk CY', 'Apron CY', 
-            'Curb CY', 'Driveway CY', 'Total SF', 'Total CY', 'Date', 'Notes'
-        ])
+    stats = load_project_stats(projects_version())
 
+    if stats['project_count']:
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
-            st.metric("Total Projects", len(df))
+            st.metric("Total Projects", stats['project_count'])
         with col2:
-            st.metric("Avg Total CY", f"{df['Total CY'].mean():.2f}")
+            st.metric("Avg Total CY", f"{stats['avg_total_cy']:.2f}")
         with col3:
-            st.metric("Total Concrete", f"{df['Total CY'].sum():.2f} CY")
+            st.metric("Total Concrete", f"{stats['sum_total_cy']:.2f} CY")
         with col4:
-            st.metric("Avg Total SF", f"{df['Total SF'].mean():.2f}")
+            st.metric("Avg Total SF", f"{stats['avg_total_sf']:.2f}")
 
-        st.bar_chart(df.set_index('Address')['Total CY'])
+        st.bar_chart(load_chart_data(projects_version()))
+        if stats['project_count'] > CHART_LIMIT:
+            st.caption(f"Chart shows the {CHART_LIMIT} most recent projects")
     else:
         st.info("No statistics available yet")